@@ -113,3 +113,8 @@ with psg1.enable_output(), psg2.enable_output(), awg.enable_output():
     dest_filepath = r"C:\Users\UTOL\Desktop\scope_capture1"
     fileio.save_waveform(signal, scope_sr, dest_filepath)
 
+    # the sample rate is cached until the timebase or acquisition settings change,
+    # so reading it after another capture does not query the scope (debug prints "(cached)")
+    signal, trigger = scope.get_waveform_bytes(channels=[1,3])
+    assert scope.get_sample_rate() == scope_sr
+
@@ -0,0 +1,80 @@
+"""
+This module holds VISA helpers shared by the instrument interfaces.
+
+Do not edit this file unless you know what you are doing.
+"""
+
+from contextlib import contextmanager
+import functools
+
+import pyvisa
+
+
+# Event status bit of the status byte, set while a standard event enabled by *ESE is pending
+STB_ESB = 0x20
+# Query, device dependent, execution and command error bits of the event status register
+# (*ESE with this makes logged errors set ESB, which drain_errors checks first)
+ESE_ERRORS = 60
+# Most errors read from an error queue in one check
+MAX_ERRORS = 32
+
+
+@functools.lru_cache(maxsize=4)
+def get_rm(visa_library):
+    """Returns the ResourceManager for <visa_library>, opening it on first use.
+
+    Loading the VISA library is slow, so every instrument shares one manager per library."""
+    return pyvisa.ResourceManager(visa_library)
+
+
+def close_resources(*resources):
+    """Closes VISA sessions, ignoring any that are already closed or unreachable.
+
+    This is run by weakref.finalize, so it must not hold a reference to the instrument object."""
+    for resource in resources:
+        try:
+            resource.close()
+        except pyvisa.errors.Error:
+            pass
+
+
+class ScpiInstrumentError(RuntimeError):
+    """Raised when an instrument reports an error for a SCPI command."""
+    def __init__(self, error_string, command=None):
+        super().__init__(f"{error_string}, command: '{command}'")
+        self.error_string = error_string
+        self.command = command
+
+
+def drain_errors(resource, error_query, command=None, exit_on_error=False):
+    """Reads and reports every error in <resource>'s error queue using <error_query>.
+
+    With [exit_on_error], the first error is raised as a ScpiInstrumentError instead."""
+    # a serial poll is much cheaper than a query, only read the queue if an error was logged
+    if not resource.read_stb() & STB_ESB:
+        return
+    resource.query("*ESR?")  # clears the ESB bit
+
+    for _ in range(MAX_ERRORS):
+        error_string = resource.query(error_query)
+        if not error_string:  # the error query should always return a string, don't keep asking
+            print(f"ERROR: {error_query} returned nothing, command: '{command}'")
+            return
+        if error_string.startswith(("0,", "+0,")):  # "No error", the usual case
+            return
+        if exit_on_error:
+            raise ScpiInstrumentError(error_string, command)
+        print(f"ERROR: {error_string}, command: '{command}'")
+
+
+@contextmanager
+def defer_error_checks(instrument, command=None):
+    """Suspends <instrument>'s per-command error checking (its check_errors attribute)
+    inside the block and calls its flush_errors once when the block is complete."""
+    saved = instrument.check_errors
+    instrument.check_errors = False
+    try:
+        yield
+    finally:
+        instrument.check_errors = saved
+        instrument.flush_errors(command, exit_on_error=False)
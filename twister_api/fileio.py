@@ -23,12 +23,21 @@ def save_waveform(waveform, samp_rate, filepath):
     sample_rate = int(samp_rate).to_bytes(8, 'big')
     num_samples = len(waveform).to_bytes(8, 'big')
 
-    for dtype in ('b', 'h', 'f'):
-        try:
-            data = array(dtype, waveform).tobytes()
-            break
-        except OverflowError:
-            continue
+    # numpy integer arrays (as returned by the oscilloscope) are written without converting each sample
+    if getattr(waveform, "dtype", None) is not None and waveform.dtype.kind == 'i' and waveform.dtype.itemsize <= 2:
+        dtype = 'b' if waveform.dtype.itemsize == 1 else 'h'
+        data = waveform.astype(waveform.dtype.newbyteorder('='), copy=False).tobytes()  # only copies to swap
+    # float arrays (get_waveform_*(voltage=True), get_waveform_ascii) are stored as 32 bit floats
+    elif getattr(waveform, "dtype", None) is not None and waveform.dtype.kind == 'f':
+        dtype = 'f'
+        data = waveform.astype('=f4', copy=False).tobytes()
+    else:
+        for dtype in ('b', 'h', 'f'):
+            try:
+                data = array(dtype, waveform).tobytes()
+                break
+            except OverflowError:
+                continue
     
     sample_type = bytes(dtype, 'ascii')
 
@@ -7,60 +7,82 @@ https://www.keysight.com/zz/en/lib/software-detail/computer-software/io-librarie
 Do not edit this file unless you know what you are doing.
 """
 
-import atexit
+from array import array
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import re
+import weakref
 
 import numpy as np
 import pyvisa
 
+from twister_api._visa import (ESE_ERRORS, ScpiInstrumentError, close_resources, defer_error_checks,
+                               drain_errors, get_rm)
+
 
 # Module level variable
 instance = None
 
+# array.array typecode for each (numpy dtype kind, itemsize) a waveform can have
+_ARRAY_TYPECODES = {('i', 1): 'b', ('i', 2): 'h', ('f', 4): 'f', ('f', 8): 'd'}
+
+# Commands that can change the sample interval or record length of a capture
+# (:WAVeform:FORMat is sent with every capture and changes neither, so it must not match)
+_SETTINGS_COMMAND = re.compile(r"(?:^|;)\s*:?(?:TIM|ACQ|AUT|\*RST)", re.IGNORECASE)
+
 class Oscilloscope:
     def __init__(self, visa_address="USB0::0x2A8D::0x9027::MY59190106::0::INSTR", *, 
-                visa_library="C:\\WINDOWS\\system32\\visa64.dll", debug=False):
+                visa_library="C:\\WINDOWS\\system32\\visa64.dll", debug=False, chunk_size=10_000_000,
+                check_errors=False):
         global instance
         instance = self
         self.debug = debug
         self.debug2 = False
-        atexit.register(self.shutdown)
+        # poll the error queue after every command (always on while debugging)
+        self.check_errors = check_errors or debug
+        self._cache = {}  # replies to settings queries, see _cached_query
+        self._io_executor = None  # worker thread for the async capture methods
 
         if self.debug:
             print(f"Initializing Oscilloscope @ {visa_address}")
 
-        rm = pyvisa.ResourceManager(visa_library)
+        rm = get_rm(visa_library)
         try:
             pyvisa.resources.Resource: self.infiniium  # type hinting
             self.infiniium = rm.open_resource(visa_address)
+            # read large waveforms in as few transfers as possible
+            self.infiniium.chunk_size = chunk_size
         except pyvisa.errors.VisaIOError as e:
             print(f"Error connecting to device string '{visa_address}'. Is the device connected?")
             raise e
+        # close the session at exit or when the scope is garbage collected, whichever is first
+        self._finalizer = weakref.finalize(self, close_resources, self.infiniium)
 
-        # This clears any pervious errors that will stope the scope from
-        self.do_command("*CLS")
+        self.infiniium.timeout = 20000
+        self.infiniium.clear()
+        # Clear status (and any pervious errors that will stop the scope from capturing)
+        # and apply the waveform settings that never change between captures
+        self.do_command(f"*CLS;*ESE {ESE_ERRORS};:SYSTem:HEADer OFF;:WAVeform:STReaming OFF;:ACQuire:COMPlete 100")
 
         if self.debug:
             idn_string = self.do_query("*IDN?")
             print(f"Connected to Oscilloscope: '{idn_string}'")
-        
-        self.infiniium.timeout = 20000
-        self.infiniium.clear()
-        # Clear status.
-        self.do_command("*CLS")
-        
-        self.do_command(":SYSTem:HEADer OFF")
 
 
     def shutdown(self):
-        self.infiniium.close()
+        if self._io_executor is not None:
+            self._io_executor.shutdown()
+        self._finalizer()
 
 
 
     def get_sample_rate(self):
-        xinc = self.do_query(":WAVeform:XINCrement?")
+        cached = ":WAVeform:XINCrement?" in self._cache
+        xinc = self._cached_query(":WAVeform:XINCrement?")
         samp_rate = 1 / float(xinc)
         if self.debug:
-            print(f"X increment: '{xinc}'\nSample rate: '{samp_rate}'")
+            print(f"X increment: '{xinc}'{' (cached)' if cached else ''}\nSample rate: '{samp_rate}'")
         return samp_rate
 
 
@@ -77,6 +99,7 @@ class Oscilloscope:
         whatever channel the scope is currently triggering on.
         
         A specific trigger channel can be specified with [trig_channel]."""
+        self._invalidate()
         self.do_command(":RUN")  # this will not work if the scope is stopped
         auto_source = False
         if not trig_channel:
@@ -91,8 +114,8 @@ class Oscilloscope:
         if self.debug:
             print("Searching for trigger period")
         # Set the threshold for period measurements
-        self.do_command(f":MEASure:THResholds:GENeral:METHod CHANnel{trig_channel},HYSTeresis")
-        self.do_command(f":MEASure:THResholds:GENeral:HYSTeresis CHANnel{trig_channel},0.1,0")
+        self.do_command(f":MEASure:THResholds:GENeral:METHod CHANnel{trig_channel},HYSTeresis;"
+                        f":MEASure:THResholds:GENeral:HYSTeresis CHANnel{trig_channel},0.1,0")
         
         period = float(self.do_query(f"MEASure:PERiod? CHANnel{trig_channel}"))
         if self.debug:
@@ -102,12 +125,10 @@ class Oscilloscope:
             if self.debug:
                 print("Count not find period with current view. Searching...")
             for p in range(9,0,-2):
-                self.do_command(f":TIMebase:RANGe 1E-{p}")
-                if self.debug:
-                    print(f"Set timebase range to {self.do_query(':TIMebase:RANGe?')}s")
-
-                period = float(self.do_query(f"MEASure:PERiod? CHANnel{trig_channel}")) # this also accepts functions as source
+                # set the range and measure in one message
+                period = float(self.do_query(f":TIMebase:RANGe 1E-{p};:MEASure:PERiod? CHANnel{trig_channel}")) # this also accepts functions as source
                 if self.debug:
+                    print(f"Set timebase range to 1E-{p}s")
                     print(f"Period measured to be: {period}")
 
                 if not period > 9e37:
@@ -118,54 +139,45 @@ class Oscilloscope:
                 raise Exception
 
         tbrange = period * n * 1.01
-        self.do_command(f":TIMebase:RANGe {tbrange:.2E}")
-        if self.debug:
-            print(f"Set timebase range to {self.do_query(':TIMebase:RANGe?')}s")
-
         if n % 2 != 0:  # set begining of first segment near left edge of scope screen
             # period / 2 - 2%
-            delay = period * 0.4951
-            self.do_command(f":TIMebase:POSition {delay:.2E}")
-            if self.debug:
-                print(f"Set timebase position to {self.do_query(':TIMebase:POSition?')}s")
+            delay = f"{period * 0.4951:.2E}"
         else:
-            self.do_command(f":TIMebase:POSition 0")
-            if self.debug:
-                print(f"Set timebase position to {self.do_query(':TIMebase:POSition?')}s")
+            delay = "0"
+        self.do_command(f":TIMebase:RANGe {tbrange:.2E};:TIMebase:POSition {delay}")
+        if self.debug:
+            tbrange, delay = self.do_query(":TIMebase:RANGe?;:TIMebase:POSition?").split(";")
+            print(f"Set timebase range to {tbrange}s")
+            print(f"Set timebase position to {delay}s")
 
 
     def set_waveform_source(self, channel):
         """Set the channel that will be used as the source for get_waveform functions"""
-        self.do_command(":WAVeform:STReaming OFF")
-        self.do_command(":ACQuire:COMPlete 100")  # take a full measurement
-
-        self.do_command(f":WAVeform:SOURce CHANnel{channel}")
-        if self.debug:
-            print(f"Set waveform source to channel: {self.do_query(':WAVeform:SOURce?')}")
+        self._invalidate()
+        with self.deferred_error_check("set_waveform_source"):
+            self.do_command(f":WAVeform:SOURce CHANnel{channel}")
+            if self.debug:
+                print(f"Set waveform source to channel: {self.do_query(':WAVeform:SOURce?')}")
 
 
 
     def set_trigger_source(self, channel):
         """Sets trigger to rising edge on channel <channel>"""
-        # Set trigger more to edge triggered
-        self.do_command(":TRIG:MODE EDGE")
-        if self.debug:
-            print(f"Trigger Mode Changed to: {self.do_query(':TRIG:MODE?')}")
-
-        # Set edge triggering on rising edge
-        self.do_command(":TRIG:EDGE:SLOP POS")
-        if self.debug:
-            print(f"Edge trigger slope set to: {self.do_query(':TRIGger:EDGE:SLOPe?')}")
+        self._invalidate()
+        with self.deferred_error_check("set_trigger_source"):
+            # Set trigger mode to edge triggered, on the rising edge, from <channel>
+            self.do_commands(":TRIG:MODE EDGE", ":TRIG:EDGE:SLOP POS", f":TRIG:EDGE:SOUR CHAN{channel}")
+            if self.debug:
+                print(f"Trigger Mode Changed to: {self.do_query(':TRIG:MODE?')}")
+                print(f"Edge trigger slope set to: {self.do_query(':TRIGger:EDGE:SLOPe?')}")
+                print(f"Trigger Source Changed to channel: {self.do_query(':TRIGger:EDGE:SOURce?')}")
 
-        # Set trigger source
-        self.do_command(f":TRIG:EDGE:SOUR CHAN{channel}")
-        if self.debug:
-            print(f"Trigger Source Changed to channel: {self.do_query(':TRIGger:EDGE:SOURce?')}")
 
 
+    def get_waveform_bytes(self, channels : list=None, functions : list=None, voltage=False):
+        """Captures 1 byte/sample waveforms from the specified scope channels and/or functions.
 
-    def get_waveform_bytes(self, channels : list=None, functions : list=None):
-        """Captures 1 byte/sample waveforms from the specified scope channels and/or functions."""
+        Set [voltage] to return the samples scaled to volts (float32) instead of raw codes."""
         if channels is None:
             channels = []
         if functions is None:
@@ -183,14 +195,17 @@ class Oscilloscope:
         # Get waveform(s) data.
         data = self._get_waveform_raw(channels, functions)
 
-        packed_data = []
-        for waveform in data: # this can probably be made more efficient
-            values = waveform.astype(np.int8).tolist()
-            packed_data.append(values)
+        # reinterpret each byte as a signed sample without copying
+        packed_data = [waveform.view(np.int8) for waveform in data]
 
         if self.debug:
             print(f"Total number of data values: {len(packed_data[0]) * len(packed_data)}")
 
+        if voltage:
+            packed_data = self._to_voltage(packed_data, channels, functions)
+
+        self.flush_errors(":WAVeform:DATA?")
+
         # if only one channel was captured, return it instead of a single element list
         if len(packed_data) == 1:
             packed_data = packed_data[0]
@@ -198,8 +213,10 @@ class Oscilloscope:
 
 
 
-    def get_waveform_words(self, channels : list=None, functions : list=None):
-        """Captures 2 byte/sample waveforms from the specified scope channels and/or functions."""
+    def get_waveform_words(self, channels : list=None, functions : list=None, voltage=False):
+        """Captures 2 byte/sample waveforms from the specified scope channels and/or functions.
+
+        See get_waveform_bytes for [voltage]."""
         if channels is None:
             channels = []
         if functions is None:
@@ -217,17 +234,17 @@ class Oscilloscope:
         # Get waveform(s) data.
         data = self._get_waveform_raw(channels, functions)
 
-        packed_data = []
-        # pack every 2 bytes into 1 short (int16)
-        for waveform in data: # I believe this is the fastest way to do this in python
-            m = (np.take(waveform, np.arange(0,waveform.size,2)).astype(np.int16))<<8
-            l = np.take(waveform, np.arange(1,waveform.size,2))
-            values = np.array((m+l), dtype=np.int16).tolist() # converting back to list takes a long time
-            packed_data.append(values)
+        # reinterpret every 2 bytes as 1 big-endian short (int16) without copying
+        packed_data = [waveform.view(np.dtype(">i2")) for waveform in data]
 
         if self.debug:
             print(f"Total number of data values: {len(packed_data[0]) * len(packed_data)}")
 
+        if voltage:
+            packed_data = self._to_voltage(packed_data, channels, functions)
+
+        self.flush_errors(":WAVeform:DATA?")
+
         # if only one channel was captured, return it instead of a single element list
         if len(packed_data) == 1:
             packed_data = packed_data[0]
@@ -235,36 +252,155 @@ class Oscilloscope:
 
 
 
+    def _to_voltage(self, data: list, channels: list, functions: list):
+        """Scales raw waveform codes to volts (float32) with each source's Y increment and origin"""
+        sources = [f"CHANnel{channel}" for channel in channels]
+        sources += [f"FUNCtion{function}" for function in functions]
+        volts = []
+        for source, values in zip(sources, data):
+            # fetch both scaling factors for the source in one message
+            yinc, yorg = map(float, self.do_query(f":WAVeform:SOURce {source};"
+                                                  ":WAVeform:YINCrement?;:WAVeform:YORigin?").split(";"))
+            scaled = values.astype(np.float32)
+            scaled *= yinc
+            scaled += yorg
+            volts.append(scaled)
+        return volts
+
+
+
+    @staticmethod
+    def as_array_array(waveform: np.ndarray) -> array:
+        """Converts a waveform returned by get_waveform_bytes/get_waveform_words into an array.array.
+
+        This is the preferred conversion when a mutable, list-like sequence is required;
+        it is much faster than waveform.tolist() and keeps each sample's size.
+        Float waveforms (from get_waveform_ascii or voltage=True) become 'f'/'d' arrays."""
+        typecode = _ARRAY_TYPECODES.get((waveform.dtype.kind, waveform.dtype.itemsize))
+        if typecode is None:
+            raise ValueError(f"Cannot convert a waveform of dtype {waveform.dtype} to an array.array")
+        values = array(typecode, [0]) * waveform.size
+        # copy (and byte-swap if needed) straight into the array's buffer
+        np.frombuffer(values, dtype=np.dtype(typecode))[:] = waveform
+        return values
+
+
+
+    def fetch_into(self, out: list, channels: list=None, functions: list=None):
+        """Captures waveforms from the specified scope channels and/or functions into the
+        preallocated arrays in <out> (one per capture, channels first), avoiding a new allocation per capture.
+
+        1 byte/sample arrays are captured in BYTE format and 2 byte/sample arrays in WORD format.
+        Returns views of <out> trimmed to the number of samples captured."""
+        if channels is None:
+            channels = []
+        if functions is None:
+            functions = []
+        if isinstance(channels, int):
+            channels = [channels]
+        if isinstance(functions, int):
+            functions = [functions]
+        if isinstance(out, np.ndarray):
+            out = [out]
+
+        if len(out) != len(channels) + len(functions):
+            raise ValueError(f"Expected {len(channels) + len(functions)} output arrays, got {len(out)}")
+        itemsizes = {buffer.dtype.itemsize for buffer in out}
+        if itemsizes - {1, 2} or len(itemsizes) > 1:
+            raise ValueError("Output arrays must all be 1 byte/sample or all be 2 bytes/sample")
+        if not all(buffer.flags.c_contiguous and buffer.flags.writeable for buffer in out):
+            raise ValueError("Output arrays must be contiguous and writeable")
+
+        # Choose the format of the data returned:
+        word = itemsizes == {2}
+        self.do_command(":WAVeform:FORMat WORD" if word else ":WAVeform:FORMat BYTE")
+
+        filled = []
+        self._request_waveforms(channels, functions)
+        for buffer in out:
+            buffer = buffer.reshape(-1)
+            length = self._read_ieee_block_header()
+            if length > buffer.nbytes:
+                self.infiniium.clear()  # discard the rest of the response
+                raise ValueError(f"Capture of {length} bytes does not fit in an array of {buffer.nbytes} bytes")
+            values = buffer[:length // buffer.dtype.itemsize]
+            self._read_into(values)
+            self.infiniium.read_bytes(1)  # ";" between responses or the terminating newline
+            if word and values.dtype != values.dtype.newbyteorder(">"):
+                values.byteswap(inplace=True)  # the scope sends words MSB first
+            filled.append(values)
+
+        self.flush_errors(":WAVeform:DATA?")
+        return filled
+
+
+
     def _get_waveform_raw(self, channels: list, functions: list):
-        data = [] # a list of lists (of bytes)
+        data = [] # a list of arrays (of bytes)
+        for _ in self._request_waveforms(channels, functions):
+            data.append(self._read_ieee_block())
+        return data
+
+
+    def _request_waveforms(self, channels: list, functions: list):
+        """Digitizes and requests every capture in one message. Returns the list of sources requested."""
+        sources = self._digitize(channels, functions)
+        if sources:
+            # the blocks are read back in order by the caller
+            self.infiniium.write(";".join(f":WAVeform:SOURce {source};:WAVeform:DATA?" for source in sources))
+        return sources
+
+
+    def _digitize(self, channels: list, functions: list):
+        """Acquires a new capture. Returns the list of sources to read it from."""
         if self.debug:
-            print(f"Waveform points: {self.do_query(':WAVeform:POINts?')}")
+            print(f"Waveform points: {self._cached_query(':WAVeform:POINts?')}")
 
-        self.do_command(f":DIGitize")
+        # wait for the acquisition to complete before requesting any data
+        self.do_query(":DIGitize;*OPC?")
 
         #TODO: enable channels if they aren't already / give warning if channels are disabled
 
-        for channel in channels:
-            self.do_command(f":WAVeform:SOURce CHANnel{channel}")
-            if self.debug:
-                print(f"Capturing waveform on channel {self.do_query(':WAVeform:SOURce?')}")
-            data.append(self.do_query_ieee_block(":WAVeform:DATA?"))
+        sources = [f"CHANnel{channel}" for channel in channels]
+        sources += [f"FUNCtion{function}" for function in functions]
+        if not sources:
+            return sources
+        if functions:  # functions may not share the channels' sample interval
+            self._invalidate()
+        if self.debug:
+            print(f"Capturing waveforms on {', '.join(sources)}")
+        return sources
+
+
+
+    async def get_waveform_bytes_async(self, channels : list=None, functions : list=None, **kwargs):
+        """Awaitable get_waveform_bytes. The capture is transferred on a worker thread so other
+        instruments can be configured from the event loop in the meantime.
+
+        Keyword arguments such as [voltage] are passed on to get_waveform_bytes."""
+        return await self._run_async(partial(self.get_waveform_bytes, channels, functions, **kwargs))
+
+
+
+    async def get_waveform_words_async(self, channels : list=None, functions : list=None, **kwargs):
+        """Awaitable get_waveform_words (see get_waveform_bytes_async)."""
+        return await self._run_async(partial(self.get_waveform_words, channels, functions, **kwargs))
 
-        for function in functions:
-            self.do_command(f":WAVeform:SOURce FUNCtion{function}")
-            if self.debug:
-                print(f"Capturing waveform on function {self.do_query(':WAVeform:SOURce?')}")
-            data.append(self.do_query_ieee_block(":WAVeform:DATA?"))
 
-        return data
 
+    async def _run_async(self, function):
+        # a single worker thread keeps captures on this scope's session one at a time
+        if self._io_executor is None:
+            self._io_executor = ThreadPoolExecutor(max_workers=1)
+        return await asyncio.get_running_loop().run_in_executor(self._io_executor, function)
 
 
-    def get_waveform_ascii(self, channel: int):
+
+    def get_waveform_ascii(self, channel: int, dtype=np.float32):
+        """Captures a waveform from <channel> in ASCII format and returns it as an array of [dtype]."""
         # Get the number of waveform points.
-        qresult = self.do_query(":WAVeform:POINts?")
         if self.debug:
-            print(f"Waveform points: {qresult}")
+            print(f"Waveform points: {self._cached_query(':WAVeform:POINts?')}")
 
         # Choose the format of the data returned:
         self.do_command(":WAVeform:FORMat ASCii")
@@ -276,9 +412,10 @@ class Oscilloscope:
 
         # Get the waveform data.
         self.do_command(f":DIGitize")
-        values = "".join(self.do_query(":WAVeform:DATA?")).split(",")
-        values.pop()  # remove last element (it's empty)
-        print(f"Number of data values: {values}")
+        # the response ends with a trailing comma
+        values = np.fromstring(self.do_query(":WAVeform:DATA?").rstrip(",\n"), sep=",", dtype=dtype)
+        if self.debug:
+            print(f"Number of data values: {values.size}")
         return values
 
 
@@ -288,39 +425,55 @@ class Oscilloscope:
         self.do_command(f":VIEW CHANnel{channel}")
 
 
+    def _cached_query(self, query):
+        """Same as do_query, but reuses the previous reply until the cache is invalidated"""
+        if query not in self._cache:
+            self._cache[query] = self.do_query(query)
+        return self._cache[query]
+
+
+    def _invalidate(self, *queries):
+        """Forget the cached replies to <queries> (or all of them if none are given)
+        after the timebase or acquisition may have changed"""
+        if not queries:
+            self._cache.clear()
+        for query in queries:
+            self._cache.pop(query, None)
+
+
     ## VISA Utils
 
     def do_command(self, command, hide_params=False):
         """Executes SCPI command on the scope."""
-        if hide_params:
-            (header, data) = command.split(" ", 1)
-            if self.debug2:
-                print(f"Cmd = '{header}'")
-        else:
-            if self.debug2:
-                print(f"Cmd = '{command}'")
+        if self.debug2:
+            print(f"Cmd = '{command.split(' ', 1)[0] if hide_params else command}'")
 
-        self.infiniium.write(str(command))
+        self.infiniium.write(command)
+        if _SETTINGS_COMMAND.search(command):
+            self._invalidate()
 
-        if hide_params:
-            self.check_instrument_errors(header)
-        else:
-            self.check_instrument_errors(command)
+        if self.check_errors:
+            self.check_instrument_errors(command.split(" ", 1)[0] if hide_params else command)
+
+
+    def do_commands(self, *commands):
+        """Executes several SCPI commands on the scope in a single message."""
+        self.do_command(";".join(commands))
 
 
     def do_command_ieee_block(self, command, values):
         """Send a command and binary values and check for errors"""
         if self.debug2:
             print(f"Cmb = '{command}'")
-        self.infiniium.write_binary_values(str(command), values, datatype='B')
-        self.check_instrument_errors(command, exit_on_errors=False)
+        self.infiniium.write_binary_values(command, values, datatype='B')
+        self.check_instrument_errors(command, exit_on_error=False)
 
 
     def do_query(self, query):
         """Send a query, check for errors, return string"""
         if self.debug2:
             print(f"Qys = '{query}'")
-        result = self.infiniium.query(str(query))
+        result = self.infiniium.query(query)
         self.check_instrument_errors(query)
         return result.rstrip()
 
@@ -329,25 +482,50 @@ class Oscilloscope:
         """Send a query, check for errors, return binary values"""
         if self.debug2:
             print(f"Qyb = '{query}'")
-        result = self.infiniium.query_binary_values(str(query), container=np.ndarray, datatype="B")
+        result = self.infiniium.query_binary_values(query, container=np.ndarray, datatype="B", header_fmt="ieee",
+                                                    chunk_size=self.infiniium.chunk_size)
         self.check_instrument_errors(query, exit_on_error=False)
         return result
 
 
+    def _read_ieee_block_header(self) -> int:
+        """Read the header of a definite-length IEEE 488.2 block and return the payload length"""
+        header = self.infiniium.read_bytes(2)  # "#" followed by the number of length digits
+        return int(self.infiniium.read_bytes(int(header[1:2])))
+
+
+    def _read_ieee_block(self) -> np.ndarray:
+        """Read one definite-length IEEE 488.2 block from a pending response"""
+        length = self._read_ieee_block_header()
+        block = np.empty(length, dtype=np.uint8)
+        self._read_into(block)
+        self.infiniium.read_bytes(1)  # ";" between responses or the terminating newline
+        return block
+
+
+    def _read_into(self, buffer: np.ndarray):
+        """Fill <buffer> from the scope one chunk at a time"""
+        buffer = buffer.reshape(-1).view(np.uint8)
+        chunk_size = self.infiniium.chunk_size
+        for offset in range(0, buffer.size, chunk_size):
+            chunk = self.infiniium.read_bytes(min(chunk_size, buffer.size - offset))
+            buffer[offset:offset + len(chunk)] = np.frombuffer(chunk, dtype=np.uint8)
+
+
     def check_instrument_errors(self, command, exit_on_error=True):
-        """Check for instrument errors"""
-        while True:
-            error_string = self.infiniium.query(":SYSTem:ERRor? STRing")
-            if error_string:  # If there is an error string value.
-                if error_string.find("0,", 0, 2) == -1:  # Not "No error".
-                    print(f"ERROR: {error_string}, command: '{command}'")
-                    if exit_on_error:
-                        print("Exited because of error.")
-                        exit()
-                else:  # "No error"
-                    break
-            else:  # :SYSTem:ERRor? STRing should always return string.
-                print(f"ERROR: :SYSTem:ERRor? STRing returned nothing, command: '{command}'")
-                if exit_on_error:
-                    print("Exited because of error.")
-                    exit()
+        """Check for instrument errors if error checking is enabled"""
+        if self.check_errors:
+            self.flush_errors(command, exit_on_error)
+
+
+    def deferred_error_check(self, command=None):
+        """Context manager that suspends per-command error checking inside the block
+        and reads the error queue once when the block is complete."""
+        return defer_error_checks(self, command)
+
+
+    def flush_errors(self, command=None, exit_on_error=False):
+        """Read and report every error in the scope's error queue
+
+        With [exit_on_error], the first error is raised as a ScpiInstrumentError instead."""
+        drain_errors(self.infiniium, ":SYSTem:ERRor? STRing", command, exit_on_error)
@@ -4,12 +4,13 @@ This module handles interfacing with the Keysight E8257D.
 Do not edit this file unless you know what you are doing.
 """
 
-import atexit
 from contextlib import contextmanager
 import math
+import weakref
 
 import pyvisa
 
+from twister_api._visa import close_resources, get_rm
 import twister_api.waveformgen_interface as waveformgen_interface
 
 
@@ -19,9 +20,8 @@ instance2 = None
 
 class SignalGenerator:
     def __init__(self, device_no=None, visa_address=None, *,
-                visa_library="C:\\WINDOWS\\system32\\visa64.dll", debug=False):
+                visa_library="C:\\WINDOWS\\system32\\visa64.dll", debug=False, chunk_size=1024 * 1024):
         self.debug = debug
-        atexit.register(self.shutdown)
 
         if visa_address is None:
             if device_no:
@@ -43,7 +43,7 @@ class SignalGenerator:
                 else:
                     raise ValueError("Valid device_no: 1, 2")
 
-        rm = pyvisa.ResourceManager(visa_library)
+        rm = get_rm(visa_library)
 
         retry = 1  # PSGs are reluctant to respond the first time after beign powered on
         while True:
@@ -57,10 +57,15 @@ class SignalGenerator:
                 else:
                     print(f"Error connecting to device string '{visa_address}' ({self.name}). Is the device connected?")
                     raise e
+            break
+
+        self.visa.chunk_size = chunk_size
+        # close the session at exit or when the PSG is garbage collected, whichever is first
+        self._finalizer = weakref.finalize(self, close_resources, self.visa)
 
 
     def shutdown(self):
-        self.visa.close()
+        self._finalizer()
 
 
     def output_enabled(self) -> bool:
@@ -117,9 +122,9 @@ class SignalGenerator:
 
     def do_command(self, command):
         """Executes SCPI command on the PSG."""
-        self.visa.write(str(command))
+        self.visa.write(command if type(command) is str else str(command))
 
 
     def do_query(self, query):
-        result = self.visa.query(str(query))
+        result = self.visa.query(query if type(query) is str else str(query))
         return result.rstrip()
\ No newline at end of file
@@ -5,7 +5,8 @@ frequently with the TWISTER equipment
 Do not edit this file unless you know what you are doing.
 """
 
-from math import pi, sqrt, sin, cos, asin, acos
+import functools
+from math import pi, sqrt, sin, cos, asin, acos, atan2
 
 import twister_api.oscilloscope_interface as scopei
 import twister_api.waveformgen_interface as awgi
@@ -19,13 +20,16 @@ import twister_api.signalgen_interface as psgi
 ## Util Functions
 
 
-def peak_phase(psg_to_adjust=1, diff_step=pi/18, max_variance=1e-2, debug=False):
+def peak_phase(psg_to_adjust=1, diff_step=pi/18, max_variance=1e-2, debug=False, lo_multiplier=None):
     """Automatically adjusts the phase on one of the local oscillators until the received signal is maximized.
 
     diff_step must be greater than 1/4 the expected period.
     if the upconverters have a multiplier of n, then actual period will be (2pi)/n
     for the maximum upconverter multiplier (12 as of this writing)
-    diff_step > pi/24"""
+    diff_step > pi/24
+
+    If the upconverter multiplier is known, pass it as [lo_multiplier] to solve for the peak
+    directly from two measurements instead of searching for it."""
     scope = scopei.instance
     awg = awgi.instance
     try:
@@ -33,8 +37,11 @@ def peak_phase(psg_to_adjust=1, diff_step=pi/18, max_variance=1e-2, debug=False)
     except IndexError:
         raise IndexError("Valid indices for Analog Signal Generator device: [1, 2]")
 
-    diff_step = diff_step*180/pi
     max_attempts = 7
+    if lo_multiplier is not None:
+        return _peak_phase_two_sample(scope, psg, lo_multiplier, diff_step, max_variance, max_attempts, debug)
+
+    diff_step = diff_step*180/pi
 
     
     ### scope
@@ -51,42 +58,21 @@ def peak_phase(psg_to_adjust=1, diff_step=pi/18, max_variance=1e-2, debug=False)
     for _ in range(max_attempts):
         x1 = 0
         psg.set_phase_reference()
-        p11 = float(scope.do_query(':MEASure:VPP? CHAN1'))
-        p12 = float(scope.do_query(':MEASure:VPP? CHAN1'))
-        if debug:
-            print(f"Measured vpp {p11}, {p12} at x1")
-        if p11 > 9e37 or p12 > 9e37:
-            scope.do_command(":AUToscale:VERTical CHANnel1")
+        p1 = _measure_vpp(scope, max_variance, debug, "x1")
+        if p1 is None:
             continue
-        if abs(p11 - p12) > max_variance:  # if measurement was greatly affected by noise, retry
-            continue
-        p1 = (p11 + p12) / 2
 
         x2 = diff_step
         psg.set_phase(x2)
-        p21 = float(scope.do_query(':MEASure:VPP? CHAN1'))
-        p22 = float(scope.do_query(':MEASure:VPP? CHAN1'))
-        if debug:
-            print(f"Measured vpp {p21}, {p22} at x2")
-        if p21 > 9e37 or p22 > 9e37:
-            scope.do_command(":AUToscale:VERTical CHANnel1")
+        p2 = _measure_vpp(scope, max_variance, debug, "x2")
+        if p2 is None:
             continue
-        if abs(p21 - p22) > max_variance:  # if measurement was greatly affected by noise, retry
-            continue
-        p2 = (p21 + p22) / 2
 
         x3 = 2*diff_step
         psg.set_phase(x3)
-        p31 = float(scope.do_query(':MEASure:VPP? CHAN1'))
-        p32 = float(scope.do_query(':MEASure:VPP? CHAN1'))
-        if debug:
-            print(f"Measured vpp {p31}, {p32} at x3")
-        if p31 > 9e37 or p32 > 9e37:
-            scope.do_command(":AUToscale:VERTical CHANnel1")
+        p3 = _measure_vpp(scope, max_variance, debug, "x3")
+        if p3 is None:
             continue
-        if abs(p31 - p32) > max_variance:  # if measurement was greatly affected by noise, retry
-            continue
-        p3 = (p31 + p32) / 2
 
         if 9.99999e37 in [p1, p2, p3]:
             print("Error measuring peak, measured signal saturated (adjust channel 1 scale)")
@@ -97,22 +83,14 @@ def peak_phase(psg_to_adjust=1, diff_step=pi/18, max_variance=1e-2, debug=False)
         m2 = (p2*x2+p3*x3)/(p2+p3)
 
         psg.set_phase(m1)
-        pm11 = float(scope.do_query(':MEASure:VPP? CHAN1'))
-        pm12 = float(scope.do_query(':MEASure:VPP? CHAN1'))
-        if debug:
-            print(f"Measured vpp {pm11}, {pm12} at m1")
-        if abs(pm11 - pm12) > max_variance:  # if measurement was greatly affected by noise, retry
+        pm1 = _measure_vpp(scope, max_variance, debug, "m1", autoscale=False)
+        if pm1 is None:
             continue
-        pm1 = (pm11 + pm12) / 2
 
         psg.set_phase(m2)
-        pm21 = float(scope.do_query(':MEASure:VPP? CHAN1'))
-        pm22 = float(scope.do_query(':MEASure:VPP? CHAN1'))
-        if debug:
-            print(f"Measured vpp {pm21}, {pm22} at m2")
-        if abs(pm21 - pm22) > max_variance:  # if measurement was greatly affected by noise, retry
+        pm2 = _measure_vpp(scope, max_variance, debug, "m2", autoscale=False)
+        if pm2 is None:
             continue
-        pm2 = (pm21 + pm22) / 2
 
         if pm1 > pm2:
             x4 = m1
@@ -135,13 +113,9 @@ def peak_phase(psg_to_adjust=1, diff_step=pi/18, max_variance=1e-2, debug=False)
 
         m3 = (p4*x4+p5*x5)/(p4+p5)
         psg.set_phase(m3)
-        pm31 = float(scope.do_query(':MEASure:VPP? CHAN1'))
-        pm32 = float(scope.do_query(':MEASure:VPP? CHAN1'))
-        if debug:
-            print(f"Measured vpp {pm31}, {pm32} at m3")
-        if abs(pm31 - pm32) > max_variance:  # if measurement was greatly affected by noise, retry
+        pm3 = _measure_vpp(scope, max_variance, debug, "m3", autoscale=False)
+        if pm3 is None:
             continue
-        pm3 = (pm31 + pm32) / 2
 
         if pm3 > p4 and pm3 > p5:
             phi = m3
@@ -155,3 +129,67 @@ def peak_phase(psg_to_adjust=1, diff_step=pi/18, max_variance=1e-2, debug=False)
     else:  # too many retries
         print("Error: Cannot automatically adjust LO phase to peak received signal.\n"
         + "Noise in measurements exceeded max_variance. Check signal or increase max_variance and try again")
+
+
+
+@functools.lru_cache(maxsize=16)
+def _trig_consts(diff_step, lo_multiplier):
+    """Returns (cos(w*diff_step), sin(w*diff_step)) for w = lo_multiplier.
+
+    These only depend on the step and the multiplier, which stay the same across a calibration sweep."""
+    w = lo_multiplier
+    return cos(w*diff_step), sin(w*diff_step)
+
+
+def _peak_phase_two_sample(scope, psg, lo_multiplier, diff_step, max_variance, max_attempts, debug):
+    """Sets the LO phase that maximizes the received signal, modelling the measured amplitude
+    as A*cos(lo_multiplier*x - phi) for a phase offset of x radians.
+
+    Measuring at x = 0 and x = diff_step gives
+        p1 = A*cos(phi)
+        p2 = A*cos(phi)*cos(w*diff_step) + A*sin(phi)*sin(w*diff_step)
+    which is solved for phi; the peak is at x = phi / w."""
+    w = lo_multiplier
+    cos_wd, sin_wd = _trig_consts(diff_step, w)
+    if abs(sin_wd) < 1e-6:
+        raise ValueError("diff_step must not be a multiple of pi/lo_multiplier")
+
+    for _ in range(max_attempts):
+        psg.set_phase_reference()
+        p1 = _measure_vpp(scope, max_variance, debug, "x1")
+        if p1 is None:
+            continue
+
+        psg.set_phase(diff_step*180/pi)
+        p2 = _measure_vpp(scope, max_variance, debug, "x2")
+        if p2 is None:
+            continue
+
+        phi = atan2((p2 - p1*cos_wd) / sin_wd, p1)
+        peak = phi / w * 180/pi
+        if debug:
+            print(f"Estimated peak at {peak:.2f} degrees")
+        psg.set_phase(peak)
+        break
+    else:  # too many retries
+        print("Error: Cannot automatically adjust LO phase to peak received signal.\n"
+        + "Noise in measurements exceeded max_variance. Check signal or increase max_variance and try again")
+
+
+def _measure_vpp(scope, max_variance, debug=False, label="", autoscale=True):
+    """Measures the peak-to-peak voltage on scope channel 1 twice.
+    Returns the average, or None if the measurement should be retried.
+
+    If [autoscale] is set, a saturated measurement rescales channel 1 and is retried."""
+    # two separate queries, so the readings can come from different acquisitions
+    # (a compound query is answered from one acquisition and the noise check below could never fail)
+    v1 = float(scope.do_query(':MEASure:VPP? CHAN1'))
+    v2 = float(scope.do_query(':MEASure:VPP? CHAN1'))
+    if debug:
+        print(f"Measured vpp {v1}, {v2} at {label}")
+    if autoscale and (v1 > 9e37 or v2 > 9e37):  # measured signal saturated
+        scope.do_command(":AUToscale:VERTical CHANnel1")
+        return None
+    if abs(v1 - v2) > max_variance:  # if measurement was greatly affected by noise, retry
+        return None
+    return (v1 + v2) / 2
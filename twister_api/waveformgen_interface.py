@@ -7,99 +7,175 @@ The M8195 Soft Front Panel must be running on the controller to facilitate comms
 Do not edit this file unless you know what you are doing.
 """
 
-import atexit
 from contextlib import contextmanager
+import functools
+import logging
+import weakref
 
-import numpy
 import pyvisa
 
+from twister_api._visa import (ESE_ERRORS, ScpiInstrumentError, close_resources, defer_error_checks,
+                               drain_errors, get_rm)
 import twister_api.signalgen_interface as signalgen_interface
 
 
 # Module level variable
 instance = None
 
+# Every SCPI message sent to the AWG is logged at DEBUG level, formatting is skipped unless it is enabled
+_log = logging.getLogger(__name__)
+
+# Commands that set every channel to 220mV and turn every output off
+_VOLT_INIT_CMDS = tuple(f":VOLTage{channel} 0.220" for channel in range(1,5))
+_OUTPUT_OFF_CMDS = tuple(f":OUTPut{channel}:STATe OFF" for channel in range(1,5))
+
+# Number of samples sent per :TRACe:DATA command when loading a waveform (a multiple of the segment granularity)
+_LOAD_CHUNK_SAMPLES = 1024 * 1024
+
+@functools.lru_cache(maxsize=8)
+def _ieee_header(nbytes):
+    """Returns the definite-length IEEE 488.2 block header for a payload of <nbytes> bytes."""
+    length = str(nbytes)
+    return f"#{len(length)}{length}".encode("ascii")
+
+
+def _shutdown(visa, debug):
+    """Disables every output and closes the AWG session (see WaveformGenerator.shutdown)."""
+    try:
+        visa.write(";".join(_OUTPUT_OFF_CMDS))
+        if debug:
+            # read every channel back in one message, the replies are separated by ';'
+            channel_states = visa.query(";".join(f":OUTPut{channel}:STATe?" for channel in range(1,5))).strip()
+            for channel, channel_state in enumerate(channel_states.split(";"), start=1):
+                print(f"Set channel {channel} state to {channel_state}")
+    except pyvisa.errors.Error as e:
+        print(f"Error disabling AWG outputs: {e}")
+    finally:
+        close_resources(visa)
+
+
 class WaveformGenerator:
+    def __new__(cls, visa_address="TCPIP0::10.10.10.11::inst0::INSTR", *,
+                visa_library="C:\\WINDOWS\\system32\\visa64.dll", **kwargs):
+        # reuse the last AWG's session if it is still open on the same address and VISA library instead of reconnecting
+        finalizer = getattr(instance, "_finalizer", None)
+        if (isinstance(instance, cls) and finalizer is not None and finalizer.alive
+                and (instance._visa_address, instance._visa_library) == (visa_address, visa_library)):
+            return instance
+        return super().__new__(cls)
+
+
     def __init__(self, visa_address="TCPIP0::10.10.10.11::inst0::INSTR", *, 
-                visa_library="C:\\WINDOWS\\system32\\visa64.dll", debug=False):
+                visa_library="C:\\WINDOWS\\system32\\visa64.dll", debug=False, check_errors=True,
+                chunk_size=1024 * 1024, reset=True):
+        """Connects to the AWG and sets its default configuration.
+
+        If the module's AWG instance is still connected to <visa_address> through <visa_library>,
+        its session is reused instead of opening a new one (with the new [debug], [check_errors]
+        and [chunk_size] settings), set [reset] to False to also keep the AWG's configuration."""
         global instance
-        instance = self
+        reused = self is instance
         self.debug = debug
-        self.debug2 = False
-        atexit.register(self.shutdown)
+        # check for errors after every command (always on while debugging),
+        # this is only a serial poll unless an error was logged
+        self.check_errors = check_errors or debug
+
+        if reused:
+            if self.debug:
+                print(f"Reusing Arbitrary Waveform Generator session @ {visa_address}")
+            self.visa.chunk_size = chunk_size
+            # the finalizer's debug setting is fixed when it is created, replace it
+            self._finalizer.detach()
+            self._finalizer = weakref.finalize(self, _shutdown, self.visa, self.debug)
+            if not reset:
+                return
+        else:
+            self._open(visa_address, visa_library, chunk_size)
+            instance = self  # only once connected, a failed attempt can be retried
 
+
+        # Set default configuration:
+        self.do_command(f"*RST;*CLS;*ESE {ESE_ERRORS}")
+        if self.debug:
+            print("Reset AWG to default config")
+
+        self.do_command(":INSTrument:DACMode MARKer")  # single channel with markers
+        if self.debug:
+            print(f"Set DAC mode to {self.do_query(':INSTrument:DACMode?')}")
+
+
+        # selt voltage on all channels to 220mv (for safety)
+        self.do_commands(*_VOLT_INIT_CMDS)
+        if self.debug:
+            channel_voltages = self.do_query(";".join(f":VOLTage{channel}?" for channel in range(1,5)))
+            for channel, channel_voltage in enumerate(channel_voltages.split(";"), start=1):
+                print(f"Channel {channel} voltage set to {float(channel_voltage):.3f} Volts")
+
+
+
+    def _open(self, visa_address, visa_library, chunk_size):
+        """Opens the VISA session to the AWG."""
         if self.debug:
             print(f"Initializing Arbitrary Waveform Generator @ {visa_address}")
 
-        rm = pyvisa.ResourceManager(visa_library)
+        rm = get_rm(visa_library)
         try:
             self.visa = rm.open_resource(visa_address)
+            self.visa.chunk_size = chunk_size
+            # the M8195A terminates every message with a newline, stop reads on it
+            self.visa.read_termination = "\n"
+            self.visa.write_termination = "\n"
         except pyvisa.errors.VisaIOError as e:
             print(f"Make sure that the M8195A SFP is started:\n" +
                    "Start Menu -> Keysight -> M8195 -> M8195 Soft Front Panel")
             print(f"Error connecting to device string '{visa_address}'. Is the device connected?")
             raise e
+        self._visa_address = visa_address
+        self._visa_library = visa_library
+        # turn the outputs off and close the session at exit or when the AWG is garbage collected
+        self._finalizer = weakref.finalize(self, _shutdown, self.visa, self.debug)
 
         if self.debug:
             idn_string = self.do_query("*IDN?")
             print(f"Connected to Arbitrary Waveform Generator: '{idn_string}'")
 
 
-        # Set default configuration:
-        self.do_command("*RST")
-        if self.debug:
-            print("Reset AWG to default config")
-
-        self.do_command(":INSTrument:DACMode MARKer")  # single channel with markers
-        if self.debug:
-            print(f"Set DAC mode to {self.do_query(':INSTrument:DACMode?')}")
-
-
-        # selt voltage on all channels to 220mv (for safety)
-        for channel in range(1,5):
-            self.do_command(f":VOLTage{channel} 0.220")
-            if self.debug:
-                channel_voltage = float(self.do_query(f":VOLTage{channel}?"))
-                print(f"Channel {channel} voltage set to {channel_voltage:.3f} Volts")
-
-
-
     def shutdown(self):
-        for channel in range(1,5):
-            self.do_command(f":OUTPut{channel}:STATe OFF")
-            if self.debug:
-                channel_state = self.do_query(f":OUTPut{channel}:STATe?")
-                print(f"Set channel {channel} state to {channel_state}")
-        self.visa.close()
+        self._finalizer()
 
 
 
 
-    def load_waveform(self, filepath, samp_rate):
-        """Loads data from file at <filepath> onto AWG"""
-        data = numpy.fromfile(filepath, dtype="H")
-        length = len(data)  # length of samples
+    def load_waveform(self, filepath, samp_rate, big_endian=False):
+        """Loads data from file at <filepath> onto AWG
 
-        self.do_command("ABORt")
-        self.do_command("TRAC1:DEL:ALL")
-        if self.debug:
-            print(f"Cleared all segments from trace 1 memory")
+        Set [big_endian] if the file's samples are already stored in the AWG's (big-endian)
+        byte order, they are then sent without being byte-swapped."""
+        import numpy  # only needed for waveform transfers, so it is not imported with the module
 
-        # Set output DAC sample rate
-        self.do_command(f":FREQuency:RASTer {samp_rate}")
-        if self.debug:
-            print(f"Set AWG sample frequency to {self.do_query(':FREQuency:RASTer?')}")
+        # map the file instead of reading it, only the chunk being sent is held in memory
+        data = numpy.memmap(filepath, dtype=">H" if big_endian else "H", mode="r")
+        length = len(data)  # length of samples
 
-        self.do_command(f":TRACe1:DEFine 1,{length}")
-        if self.debug:
-            print(f"Defined segment 1 of length {length} on trace 1")
-        self.do_command_ieee_block(":TRACe1:DATA 1,0,", data)
+        with self.deferred_error_check("load_waveform"):
+            # stop, clear trace 1, set the output DAC sample rate and define the segment in one message
+            # (every header is absolute, so none of them depend on the one before it)
+            self.do_commands(":ABORt",
+                             ":TRACe1:DELete:ALL",
+                             f":FREQuency:RASTer {samp_rate}",
+                             f":TRACe1:DEFine 1,{length}")
+            if self.debug:
+                print(f"Cleared all segments from trace 1 memory")
+                print(f"Set AWG sample frequency to {self.do_query(':FREQuency:RASTer?')}")
+                print(f"Defined segment 1 of length {length} on trace 1")
+            for offset in range(0, length, _LOAD_CHUNK_SAMPLES):
+                self.do_command_ieee_block(f":TRACe1:DATA 1,{offset},", data[offset:offset + _LOAD_CHUNK_SAMPLES])
 
-        if self.debug:
-            print(f"Trace 1 segment, length: {self.do_query(':TRACe1:CATalog?')}")
+            if self.debug:
+                print(f"Trace 1 segment, length: {self.do_query(':TRACe1:CATalog?')}")
 
-        # enable waveform generation
-        self.do_command(":INIT:IMM")
+            # enable waveform generation
+            self.do_command(":INIT:IMM")
 
             
 
@@ -113,81 +189,104 @@ class WaveformGenerator:
             or signalgen_interface.instance2 is not None and not signalgen_interface.instance2.output_enabled()):
                 raise RuntimeError("Warning: Enable LO output before enabling AWG")
             # enable output on channel 1 and 3 
-            self.do_command(":OUTPut1:STATe ON")
-            self.do_command(":OUTPut3:STATe ON")
+            self.do_commands(":OUTPut1:STATe ON", ":OUTPut3:STATe ON")
             if self.debug:
-                print(f"Channel 1 state: {self.do_query(':OUTPut1:STATe?')}")
-                print(f"Channel 3 state: {self.do_query(':OUTPut3:STATe?')}")
+                self._print_output_states()
 
             yield
         except RuntimeError as e:
             print(e)
             raise e
         finally:
-            self.do_command(f":OUTPut1:STATe OFF")
-            self.do_command(f":OUTPut3:STATe OFF")
+            self.do_commands(":OUTPut1:STATe OFF", ":OUTPut3:STATe OFF")
             if self.debug:
-                print(f"Channel 1 state: {self.do_query(':OUTPut1:STATe?')}")
-                print(f"Channel 3 state: {self.do_query(':OUTPut3:STATe?')}")
+                self._print_output_states()
 
     
+    def _print_output_states(self):
+        """Prints the state of channels 1 and 3, read back in one message."""
+        state1, state3 = self.do_query(':OUTPut1:STATe?;:OUTPut3:STATe?').split(";")
+        print(f"Channel 1 state: {state1}")
+        print(f"Channel 3 state: {state3}")
+
+
     def output_enabled(self) -> bool: #TODO check if there is a better command for this
-        """Returns true if AWG channel 1 output is enabled"""
-        c1 = bool(int(self.do_query(':OUTPut1:STATe?')))
-        c2 = bool(int(self.do_query(':OUTPut2:STATe?')))
-        c3 = bool(int(self.do_query(':OUTPut3:STATe?')))
-        c4 = bool(int(self.do_query(':OUTPut4:STATe?')))
-        return c1 or c2 or c3 or c4
+        """Returns true if any AWG channel output is enabled"""
+        # query all four channels in one message, the replies are separated by ';'
+        states = self.do_query(':OUTPut1:STATe?;:OUTPut2:STATe?;:OUTPut3:STATe?;:OUTPut4:STATe?').split(";")
+        return any(bool(int(state)) for state in states)
 
 
     ## VISA Utils
 
-    def do_command(self, command, hide_params=False):
-        """Executes SCPI command on the AWG."""
-        if hide_params:
-            header, = command.split(" ", 1)
-            if self.debug2:
-                print(f"Cmd = '{header}'")
-        else:
-            if self.debug2:
-                print(f"Cmd = '{command}'")
-        self.visa.write(str(command))
-        self.check_instrument_errors(command, exit_on_error=False)
+    def do_command(self, command, hide_params=False, check_errors=True):
+        """Executes SCPI command on the AWG.
+
+        Set [check_errors] to False to defer the error check to the caller."""
+        command = command if type(command) is str else str(command)
+        _log.debug("Cmd = '%s'", command.split(" ", 1)[0] if hide_params else command)
+        self.visa.write(command)
+        if check_errors:
+            self.check_instrument_errors(command, exit_on_error=False)
+
+
+    def do_commands(self, *commands):
+        """Executes several SCPI commands on the AWG in a single message."""
+        self.do_command(";".join(commands))
 
 
     def do_command_ieee_block(self, command, values):
-        """Send a command and binary values and check for errors."""
-        if self.debug2:
-            print(f"Cmb = '{command}'")
-        self.visa.write_binary_values(str(command), values, datatype='H', is_big_endian=True)
+        """Send a command and binary values and check for errors.
+
+        [values] is either a numpy array (or sequence) of 16 bit samples, which are sent as
+        big-endian unsigned words, or a bytes-like object that is already encoded and sent as-is."""
+        command = command if type(command) is str else str(command)
+        _log.debug("Cmb = '%s'", command)
+        import numpy
+
+        if isinstance(values, (bytes, bytearray, memoryview)):
+            data = memoryview(values).cast("B")
+        else:
+            # convert to big-endian samples in one numpy pass (no copy is made if they already are)
+            # and assemble the message in a single join instead of letting pyvisa pack every sample
+            data = numpy.ascontiguousarray(values, dtype=">u2").view(numpy.uint8)
+        termination = (self.visa.write_termination or "").encode("ascii")
+        self.visa.write_raw(b"".join((command.encode("ascii"), _ieee_header(data.nbytes), data, termination)))
         self.check_instrument_errors(command, exit_on_error=False)
 
 
     def do_query(self, query):
         """Send a query, check for errors, return string."""
-        if self.debug2:
-            print(f"Qys = '{query}'")
-        result = self.visa.query(str(query)).strip()
+        query = query if type(query) is str else str(query)
+        _log.debug("Qys = '%s'", query)
+        result = self.visa.query(query).strip()
         return result
 
 
-    def do_query_ieee_block(self, query):
+    def do_query_ieee_block(self, query) -> "numpy.ndarray":
         """Send a query, check for errors, return binary values."""
-        if self.debug2:
-            print(f"Qyb = '{query}'")
-        result = self.visa.query_binary_values(str(query), datatype="s", container=bytes)
+        query = query if type(query) is str else str(query)
+        _log.debug("Qyb = '%s'", query)
+        import numpy
+
+        result = self.visa.query_binary_values(query, datatype="B", container=numpy.ndarray)
         return result
 
 
     def check_instrument_errors(self, command, exit_on_error=True):
-        """Check for instrument errors."""
-        while True:
-            error_string = self.visa.query(":SYSTem:ERRor?")
-            if error_string:  # If there is an error string value.
-                if error_string.find("0,", 0, 2) == -1:  # Not "No error".
-                    print(f"ERROR: {error_string}, command: '{command}'")
-                    if exit_on_error:
-                        print("Exited because of error.")
-                        exit()
-                else:  # "No error"
-                    break
+        """Check for instrument errors if error checking is enabled."""
+        if self.check_errors:
+            self.flush_errors(command, exit_on_error)
+
+
+    def deferred_error_check(self, command=None):
+        """Context manager that suspends per-command error checking inside the block
+        and reads the error queue once when the block is complete."""
+        return defer_error_checks(self, command)
+
+
+    def flush_errors(self, command=None, exit_on_error=False):
+        """Read and report every error in the AWG's error queue.
+
+        With [exit_on_error], the first error is raised as a ScpiInstrumentError instead."""
+        drain_errors(self.visa, ":SYSTem:ERRor?", command, exit_on_error)